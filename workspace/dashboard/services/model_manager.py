@@ -1,44 +1,506 @@
+import functools
+import hashlib
+import importlib.util
 import logging
-from huggingface_hub import snapshot_download
-import torch
+import os
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from types import MappingProxyType
+
+# huggingface_hub reads this flag when it is first imported, so set it up front.
+# Only opt in when hf_transfer is installed, otherwise downloads would fail.
+if importlib.util.find_spec("hf_transfer") is not None:
+    os.environ.setdefault("HF_HUB_ENABLE_HF_TRANSFER", "1")
 
 logger = logging.getLogger(__name__)
 
-MODEL_CONFIGURATIONS = {
-    "CodeBERT Small": {
-        "repo_id": "huggingface/CodeBERTa-small-v1",
-        "filename": None,
-        "revision": "main",
-        "context_length": 512,
-        "device": "cuda" if torch.cuda.is_available() else "cpu",
-        # Optional: Add tokenizer and model class if required by loading logic
-        # "tokenizer_class": "RobertaTokenizer",
-        # "model_class": "RobertaForMaskedLM"
-    },
+class ModelDownloadError(Exception):
+    """A model snapshot or file could not be downloaded.
+
+    status_code is the HTTP status a web layer should translate this to.
+    """
+
+    def __init__(self, message, cause=None, status_code=400):
+        super().__init__(message)
+        self.cause = cause
+        self.status_code = status_code
+
+# Always skipped: weights for frameworks we never load (TF, Flax, rust-bert)
+# and export formats; per-model "ignore_patterns" are added on top
+DOWNLOAD_IGNORE_PATTERNS = ["*.h5", "*.msgpack", "*.ot", "*.onnx"]
+
+def _env_worker_count(name, default):
+    raw = os.environ.get(name)
+    if raw is None:
+        return default
+    try:
+        value = int(raw)
+    except ValueError:
+        logger.warning(f"Ignoring invalid {name}={raw!r}, using {default}")
+        return default
+    if value < 1:
+        logger.warning(f"{name}={value} is below 1, using 1")
+        return 1
+    return value
+
+# Per-file download workers; override to tune for slow or fat links
+DOWNLOAD_MAX_WORKERS = _env_worker_count(
+    "FEDORA_ASSIST_DOWNLOAD_WORKERS", min(16, os.cpu_count() or 1)
+)
+# Bounds how many snapshots are fetched at once across all callers
+MAX_CONCURRENT_DOWNLOADS = 3
+_download_semaphore = threading.BoundedSemaphore(MAX_CONCURRENT_DOWNLOADS)
+
+# Stable snapshot cache; interrupted downloads resume from the blobs already here
+MODEL_CACHE_DIR = os.path.expanduser(
+    os.environ.get("FEDORA_ASSIST_MODEL_CACHE", "~/.cache/fedora_assistant/models")
+)
+
+# Set PREFETCH_ON_STARTUP=0 on low-RAM hosts to skip warming the page cache
+PREFETCH_ON_STARTUP = os.environ.get("PREFETCH_ON_STARTUP", "1").lower() not in ("0", "false", "no")
+WEIGHT_FILE_SUFFIXES = (".safetensors", ".bin")
+# Hub cache blobs for LFS files are named after their SHA-256
+_SHA256_HEX = re.compile(r"[0-9a-f]{64}")
+
+# Resolved snapshot paths keyed by (ModelConfig, streaming), so repeat calls
+# skip snapshot_download's metadata requests and cache scan
+_PATH_CACHE = {}
+_path_cache_lock = threading.Lock()
+
+DOWNLOAD_RETRY_ATTEMPTS = 5
+DOWNLOAD_RETRY_MAX_WAIT = 30
+
+@functools.lru_cache(maxsize=1)
+def _device():
+    """Probe for CUDA once; every model entry shares the result."""
+    import torch
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+CACHE_STRATEGIES = ("download", "streaming")
+
+@dataclass(frozen=True)
+class ModelConfig:
+    repo_id: str
+    revision: str = "main"
+    context_length: int = 512
+    # Empty means the whole repo (minus DOWNLOAD_IGNORE_PATTERNS)
+    allow_patterns: tuple = ()
+    ignore_patterns: tuple = ()
+    # "streaming" fetches weights on first use via fetch_model_file
+    cache_strategy: str = "download"
+    # Optional: add tokenizer and model class if required by loading logic
+    # tokenizer_class: str = "RobertaTokenizer"
+    # model_class: str = "RobertaForMaskedLM"
+
+    def __post_init__(self):
+        if self.cache_strategy not in CACHE_STRATEGIES:
+            raise ValueError(
+                f"Unknown cache_strategy {self.cache_strategy!r}, "
+                f"expected one of {CACHE_STRATEGIES}"
+            )
+
+    @property
+    def device(self):
+        # Resolved on first access so importing this module never touches torch
+        return _device()
+
+# Read-only so the cached _MODEL_NAMES below cannot drift out of sync
+MODEL_CONFIGURATIONS = MappingProxyType({
+    "CodeBERT Small": ModelConfig(
+        repo_id="huggingface/CodeBERTa-small-v1",
+        # Only what the RoBERTa BPE tokenizer and PyTorch weights need
+        allow_patterns=("*.json", "*.txt", "*.safetensors", "*.bin"),
+    ),
     # Add other existing models here if the original file has them, e.g.:
-    # "llama-2-7b": {"repo_id": "meta-llama/Llama-2-7b-hf", ...}
-}
+    # "llama-2-7b": ModelConfig(repo_id="meta-llama/Llama-2-7b-hf", ignore_patterns=("original/*",)),
+})
+_MODEL_NAMES = tuple(MODEL_CONFIGURATIONS)
+
+def _hub_errors():
+    try:
+        from huggingface_hub import errors
+    except ImportError:
+        # huggingface_hub < 0.23 only exposes them from utils
+        from huggingface_hub import utils as errors
+    return errors
+
+def _transport_errors():
+    """Network-level errors from whichever HTTP client huggingface_hub uses."""
+    transport_errors = []
+    try:
+        import requests
+    except ImportError:
+        pass
+    else:
+        transport_errors += [requests.ConnectionError, requests.Timeout]
+    try:
+        import httpx
+    except ImportError:
+        pass
+    else:
+        # huggingface_hub >= 1.0
+        transport_errors += [httpx.TimeoutException, httpx.NetworkError, httpx.RemoteProtocolError]
+    return tuple(transport_errors)
+
+def _hub_offline():
+    return os.environ.get("HF_HUB_OFFLINE", "").upper() in ("1", "ON", "YES", "TRUE")
+
+def _is_transient_error(exc):
+    errors = _hub_errors()
+    if _is_not_found_error(exc):
+        return False
+    if isinstance(exc, _transport_errors()):
+        return True
+    # Raised when the Hub is unreachable and nothing usable is cached yet;
+    # in offline mode that will never change, so fail straight away
+    if isinstance(exc, errors.LocalEntryNotFoundError):
+        return not _hub_offline()
+    if isinstance(exc, errors.HfHubHTTPError):
+        response = getattr(exc, "response", None)
+        status = response.status_code if response is not None else None
+        return status is None or status == 429 or status >= 500
+    return False
+
+def _is_gated_error(exc):
+    gated = getattr(_hub_errors(), "GatedRepoError", None)
+    return gated is not None and isinstance(exc, gated)
+
+def _is_not_found_error(exc):
+    errors = _hub_errors()
+    # GatedRepoError subclasses RepositoryNotFoundError, but the repo exists
+    return (
+        isinstance(exc, (
+            errors.RepositoryNotFoundError,
+            errors.RevisionNotFoundError,
+            errors.EntryNotFoundError,
+        ))
+        and not isinstance(exc, errors.LocalEntryNotFoundError)
+        and not _is_gated_error(exc)
+    )
+
+def _error_status(exc):
+    """HTTP status to report for a failed Hub download."""
+    if _is_gated_error(exc):
+        return 403
+    if _is_not_found_error(exc):
+        return 404
+    return 400
+
+def _retry_transient(fetch, description):
+    """Call fetch(), retrying transient Hub/network errors with jittered backoff."""
+    for attempt in range(1, DOWNLOAD_RETRY_ATTEMPTS + 1):
+        try:
+            return fetch()
+        except Exception as e:
+            if attempt == DOWNLOAD_RETRY_ATTEMPTS or not _is_transient_error(e):
+                raise
+            wait = min(0.5 * 2 ** (attempt - 1), DOWNLOAD_RETRY_MAX_WAIT) + random.uniform(0, 0.5)
+            logger.warning(
+                f"Transient error downloading {description} "
+                f"(attempt {attempt}/{DOWNLOAD_RETRY_ATTEMPTS}), retrying in {wait:.1f}s: {str(e)}"
+            )
+            time.sleep(wait)
+
+class _CallbackFailed(Exception):
+    """Carries an on_file_ready error past download_model's Hub error mapping."""
+
+    def __init__(self, error):
+        super().__init__(str(error))
+        self.error = error
+
+def _download_files_as_ready(config, revision, allow_patterns, ignore_patterns, on_file_ready):
+    """Fetch a snapshot file by file, calling on_file_ready(path) as each lands.
+
+    Files are pinned to one commit so a moving branch cannot mix revisions.
+    Returns the snapshot directory, like snapshot_download. On the first
+    failure queued files are cancelled, and files already in flight are
+    waited for so the caller's download semaphore still bounds them.
+    """
+    from huggingface_hub import HfApi, hf_hub_download, snapshot_download
+    from huggingface_hub.utils import filter_repo_objects
+
+    repo_id = config.repo_id
+    info = _retry_transient(
+        lambda: HfApi().model_info(repo_id, revision=revision),
+        f"file list for {repo_id}"
+    )
+    filenames = list(filter_repo_objects(
+        [sibling.rfilename for sibling in info.siblings],
+        allow_patterns=allow_patterns,
+        ignore_patterns=ignore_patterns
+    ))
+    if not filenames:
+        # Nothing would land in the cache, so there is no snapshot to return
+        raise ModelDownloadError(
+            f"No files in {repo_id}@{info.sha} match the configured download patterns",
+            status_code=404
+        )
+
+    def fetch(filename):
+        return _retry_transient(
+            lambda: hf_hub_download(
+                repo_id=repo_id,
+                filename=filename,
+                revision=info.sha,
+                cache_dir=MODEL_CACHE_DIR
+            ),
+            f"{filename} from {repo_id}"
+        )
+
+    executor = ThreadPoolExecutor(max_workers=DOWNLOAD_MAX_WORKERS)
+    futures = [executor.submit(fetch, name) for name in filenames]
+    try:
+        for future in as_completed(futures):
+            path = future.result()
+            try:
+                on_file_ready(path)
+            except Exception as e:
+                raise _CallbackFailed(e) from e
+    except BaseException:
+        _cancel_pending(executor, futures, wait=True)
+        raise
+    executor.shutdown()
+
+    return snapshot_download(
+        repo_id=repo_id,
+        revision=info.sha,
+        cache_dir=MODEL_CACHE_DIR,
+        local_files_only=True
+    )
+
+def _download_patterns(config):
+    """(allow_patterns, ignore_patterns) for a model, before any streaming filter."""
+    allow_patterns = list(config.allow_patterns) or None
+    ignore_patterns = DOWNLOAD_IGNORE_PATTERNS + list(config.ignore_patterns)
+    return allow_patterns, ignore_patterns
 
-def download_model(model_name):
+def download_model(model_name, on_file_ready=None):
+    """Download a configured model and return its local snapshot directory.
+
+    If on_file_ready is given, files are fetched individually and the
+    callback receives each local file path as soon as that file is on disk,
+    so loading can start before slower shards finish.
+    """
     if model_name not in MODEL_CONFIGURATIONS:
         logger.error(f"Model {model_name} not found in configurations")
         raise ValueError(f"400: Failed to download model {model_name}")
     
+    # Deferred so importing this module (e.g. for list_models) stays cheap
+    from huggingface_hub import snapshot_download
+
     config = MODEL_CONFIGURATIONS[model_name]
+    revision = config.revision
+    allow_patterns, ignore_patterns = _download_patterns(config)
+    streaming = config.cache_strategy == "streaming"
+    if streaming:
+        # Config and tokenizer files only; weights are pulled by fetch_model_file
+        ignore_patterns = ignore_patterns + ["*" + suffix for suffix in WEIGHT_FILE_SUFFIXES]
+    # The whole frozen config, so models sharing a repo but not its patterns
+    # never share an entry
+    cache_key = (config, streaming)
+    if on_file_ready is None:
+        with _path_cache_lock:
+            cached_path = _PATH_CACHE.get(cache_key)
+        if cached_path is not None:
+            return cached_path
+
+    def fetch():
+        with _download_semaphore:
+            return snapshot_download(
+                repo_id=config.repo_id,
+                revision=revision,
+                cache_dir=MODEL_CACHE_DIR,
+                allow_patterns=allow_patterns,
+                ignore_patterns=ignore_patterns,
+                max_workers=DOWNLOAD_MAX_WORKERS
+            )
+
     try:
-        path = snapshot_download(
-            repo_id=config["repo_id"],
-            revision=config.get("revision", "main"),
-            allow_patterns=config["filename"]
-        )
+        if on_file_ready is None:
+            path = _retry_transient(fetch, f"model {model_name}")
+        else:
+            # Each request inside retries on its own
+            with _download_semaphore:
+                path = _download_files_as_ready(
+                    config, revision, allow_patterns, ignore_patterns, on_file_ready
+                )
         logger.info(f"Model {model_name} downloaded to {path}")
+        with _path_cache_lock:
+            _PATH_CACHE[cache_key] = path
         return path
+    except _CallbackFailed as e:
+        # The caller's own bug, not a download failure: hand it back untouched
+        raise e.error from e.error.__cause__
+    except ModelDownloadError as e:
+        logger.error(f"Error downloading model {model_name}: {str(e)}")
+        raise
     except Exception as e:
         logger.error(f"Error downloading model {model_name}: {str(e)}")
-        raise HTTPException(status_code=400, detail=str(e))
+        raise ModelDownloadError(
+            str(e), cause=e, status_code=_error_status(e)
+        ) from e
+
+def fetch_model_file(model_name, filename):
+    """Download one file of a model on demand, e.g. a single weight shard.
+
+    The file is pinned to the commit download_model resolved, so it lands
+    in the same snapshot directory as the model's other files.
+    """
+    if model_name not in MODEL_CONFIGURATIONS:
+        logger.error(f"Model {model_name} not found in configurations")
+        raise ValueError(f"400: Failed to download model {model_name}")
+
+    from huggingface_hub import hf_hub_download
+    from huggingface_hub.utils import filter_repo_objects
+
+    config = MODEL_CONFIGURATIONS[model_name]
+    allow_patterns, ignore_patterns = _download_patterns(config)
+    if not list(filter_repo_objects(
+        [filename], allow_patterns=allow_patterns, ignore_patterns=ignore_patterns
+    )):
+        raise ModelDownloadError(
+            f"{filename} is excluded by the download patterns of model {model_name}"
+        )
+
+    # Snapshot directories are named after the commit they hold
+    commit = os.path.basename(os.path.normpath(download_model(model_name)))
+
+    def fetch():
+        with _download_semaphore:
+            return hf_hub_download(
+                repo_id=config.repo_id,
+                filename=filename,
+                revision=commit,
+                cache_dir=MODEL_CACHE_DIR
+            )
+
+    try:
+        return _retry_transient(fetch, f"{filename} for model {model_name}")
+    except Exception as e:
+        logger.error(f"Error downloading {filename} for model {model_name}: {str(e)}")
+        raise ModelDownloadError(
+            str(e), cause=e, status_code=_error_status(e)
+        ) from e
+
+def _cancel_pending(executor, futures, wait=False):
+    """Drop queued work and shut down, optionally waiting for running tasks."""
+    for future in futures:
+        future.cancel()
+    executor.shutdown(wait=wait)
+
+def download_models(model_names, max_workers=MAX_CONCURRENT_DOWNLOADS):
+    """Download several models concurrently; returns {model_name: path}.
+
+    Results are collected as each download finishes. The first failure is
+    raised as soon as it completes: queued downloads are cancelled, and
+    ones already running finish in the background. Actual fetches stay
+    bounded by MAX_CONCURRENT_DOWNLOADS; extra workers only help with
+    cached models.
+    """
+    paths = {}
+    executor = ThreadPoolExecutor(max_workers=max(1, max_workers))
+    futures = {
+        executor.submit(download_model, name): name
+        for name in dict.fromkeys(model_names)
+    }
+    try:
+        for future in as_completed(futures):
+            paths[futures[future]] = future.result()
+    except BaseException:
+        _cancel_pending(executor, futures)
+        raise
+    executor.shutdown()
+    return paths
+
+def _warm_page_cache(path):
+    """Ask the kernel to read weight files under path into the page cache."""
+    if not hasattr(os, "posix_fadvise"):
+        return
+    for root, _, files in os.walk(path):
+        for name in files:
+            if not name.endswith(WEIGHT_FILE_SUFFIXES):
+                continue
+            try:
+                fd = os.open(os.path.join(root, name), os.O_RDONLY)
+            except OSError:
+                continue
+            try:
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+            except OSError:
+                pass
+            finally:
+                os.close(fd)
+
+def prefetch_models(model_names=None):
+    """Download models and warm their weights in a background thread.
+
+    Defaults to every configured model. Returns the started thread, or None
+    when prefetching is disabled via PREFETCH_ON_STARTUP.
+    """
+    if not PREFETCH_ON_STARTUP:
+        return None
+    model_names = list(model_names) if model_names is not None else list_models()
+
+    def _prefetch():
+        for name in model_names:
+            try:
+                path = download_model(name)
+            except Exception as e:
+                logger.warning(f"Prefetch of model {name} failed: {str(e)}")
+                continue
+            _warm_page_cache(path)
+
+    thread = threading.Thread(target=_prefetch, name="model-prefetch", daemon=True)
+    thread.start()
+    return thread
+
+def _sha256_file(path):
+    with open(path, "rb") as f:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        if hasattr(hashlib, "file_digest"):
+            # Python 3.11+: readinto a reused buffer, no bytes object per chunk
+            return hashlib.file_digest(f, "sha256").hexdigest()
+        digest = hashlib.sha256()
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+        return digest.hexdigest()
+
+def _verify_shard(path, expected_sha256):
+    return _sha256_file(path) == expected_sha256.lower()
+
+def verify_snapshot(path):
+    """Check weight files under a snapshot directory for on-disk corruption.
+
+    Each file is hashed and compared with the SHA-256 its cache blob is
+    named after. Files without such a blob name are skipped. Returns the
+    paths that did not match.
+    """
+    corrupted = []
+    for root, _, files in os.walk(path):
+        for name in files:
+            if not name.endswith(WEIGHT_FILE_SUFFIXES):
+                continue
+            file_path = os.path.join(root, name)
+            blob_name = os.path.basename(os.path.realpath(file_path))
+            if not _SHA256_HEX.fullmatch(blob_name):
+                continue
+            if not _verify_shard(file_path, blob_name):
+                logger.warning(f"Checksum mismatch for {file_path}")
+                corrupted.append(file_path)
+    return corrupted
+
+def clear_model_cache():
+    """Forget resolved snapshot paths so the next download_model re-resolves."""
+    with _path_cache_lock:
+        _PATH_CACHE.clear()
 
 # Add any other functions from the original file here, e.g., load_model, list_models, etc.
 def list_models():
-    return list(MODEL_CONFIGURATIONS.keys())
+    return _MODEL_NAMES
 
 # If the original has more, merge it in.
@@ -0,0 +1,366 @@
+import fnmatch
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+import types
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services"))
+
+import model_manager
+
+
+class HfHubHTTPError(Exception):
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.response = types.SimpleNamespace(status_code=status_code) if status_code else None
+
+
+class RepositoryNotFoundError(HfHubHTTPError):
+    pass
+
+
+class RevisionNotFoundError(HfHubHTTPError):
+    pass
+
+
+class EntryNotFoundError(HfHubHTTPError):
+    pass
+
+
+class LocalEntryNotFoundError(EntryNotFoundError):
+    pass
+
+
+class GatedRepoError(RepositoryNotFoundError):
+    pass
+
+
+def _filter_repo_objects(items, allow_patterns=None, ignore_patterns=None):
+    return [
+        item for item in items
+        if (not allow_patterns or any(fnmatch.fnmatch(item, p) for p in allow_patterns))
+        and not any(fnmatch.fnmatch(item, p) for p in ignore_patterns or ())
+    ]
+
+
+def _stub_hub(snapshot_download=None, **attrs):
+    """A minimal huggingface_hub exposing only what model_manager touches."""
+    hub = types.ModuleType("huggingface_hub")
+    errors = types.ModuleType("huggingface_hub.errors")
+    utils = types.ModuleType("huggingface_hub.utils")
+    for cls in (HfHubHTTPError, RepositoryNotFoundError, RevisionNotFoundError,
+                EntryNotFoundError, LocalEntryNotFoundError, GatedRepoError):
+        setattr(errors, cls.__name__, cls)
+    utils.filter_repo_objects = _filter_repo_objects
+    hub.errors = errors
+    hub.utils = utils
+    hub.snapshot_download = snapshot_download
+    for name, value in attrs.items():
+        setattr(hub, name, value)
+    return {"huggingface_hub": hub, "huggingface_hub.errors": errors, "huggingface_hub.utils": utils}
+
+
+def _stub_api(filenames, sha="abc123"):
+    info = types.SimpleNamespace(
+        sha=sha, siblings=[types.SimpleNamespace(rfilename=name) for name in filenames]
+    )
+    return mock.Mock(return_value=mock.Mock(model_info=mock.Mock(return_value=info)))
+
+
+class EnvWorkerCountTests(unittest.TestCase):
+    name = "FEDORA_ASSIST_DOWNLOAD_WORKERS"
+
+    def _count(self, raw):
+        with mock.patch.dict(os.environ, {self.name: raw}):
+            return model_manager._env_worker_count(self.name, 8)
+
+    def test_non_integer_falls_back_to_default(self):
+        with self.assertLogs(model_manager.logger, "WARNING"):
+            self.assertEqual(self._count("abc"), 8)
+
+    def test_zero_is_clamped_to_one(self):
+        with self.assertLogs(model_manager.logger, "WARNING"):
+            self.assertEqual(self._count("0"), 1)
+
+    def test_valid_override_is_used(self):
+        self.assertEqual(self._count("5"), 5)
+
+
+
+class DownloadModelErrorTests(unittest.TestCase):
+    model_name = "CodeBERT Small"
+
+    def setUp(self):
+        model_manager.clear_model_cache()
+        self.sleep = mock.patch.object(model_manager.time, "sleep").start()
+        self.addCleanup(mock.patch.stopall)
+        mock.patch.dict(os.environ).start()
+        os.environ.pop("HF_HUB_OFFLINE", None)
+
+    def _download(self, side_effect, env=None):
+        snapshot_download = mock.Mock(side_effect=side_effect)
+        mock.patch.dict(sys.modules, _stub_hub(snapshot_download)).start()
+        mock.patch.dict(os.environ, env or {}).start()
+        with self.assertRaises(model_manager.ModelDownloadError) as ctx:
+            model_manager.download_model(self.model_name)
+        return ctx.exception, snapshot_download
+
+    def test_missing_repo_maps_to_404_without_retry(self):
+        error = RepositoryNotFoundError("no such repo", status_code=404)
+        exc, snapshot_download = self._download(error)
+        self.assertEqual(exc.status_code, 404)
+        self.assertIs(exc.cause, error)
+        self.assertEqual(snapshot_download.call_count, 1)
+        self.sleep.assert_not_called()
+
+    def test_gated_repo_maps_to_403_without_retry(self):
+        exc, snapshot_download = self._download(GatedRepoError("accept the license", status_code=403))
+        self.assertEqual(exc.status_code, 403)
+        self.assertEqual(snapshot_download.call_count, 1)
+        self.sleep.assert_not_called()
+
+    def test_server_errors_are_retried_until_attempts_run_out(self):
+        error = HfHubHTTPError("unavailable", status_code=503)
+        exc, snapshot_download = self._download(error)
+        self.assertEqual(exc.status_code, 400)
+        self.assertIs(exc.cause, error)
+        self.assertEqual(snapshot_download.call_count, model_manager.DOWNLOAD_RETRY_ATTEMPTS)
+        self.assertEqual(self.sleep.call_count, model_manager.DOWNLOAD_RETRY_ATTEMPTS - 1)
+
+    def test_transient_error_then_success_returns_path(self):
+        snapshot_download = mock.Mock(side_effect=[HfHubHTTPError("busy", status_code=429), "/snap/abc"])
+        mock.patch.dict(sys.modules, _stub_hub(snapshot_download)).start()
+        self.assertEqual(model_manager.download_model(self.model_name), "/snap/abc")
+        self.assertEqual(snapshot_download.call_count, 2)
+
+    def test_client_errors_are_not_retried(self):
+        exc, snapshot_download = self._download(HfHubHTTPError("forbidden", status_code=403))
+        self.assertEqual(exc.status_code, 400)
+        self.assertEqual(snapshot_download.call_count, 1)
+
+    def test_local_miss_is_not_retried_when_offline(self):
+        exc, snapshot_download = self._download(
+            LocalEntryNotFoundError("not cached"), env={"HF_HUB_OFFLINE": "1"}
+        )
+        self.assertEqual(exc.status_code, 400)
+        self.assertEqual(snapshot_download.call_count, 1)
+        self.sleep.assert_not_called()
+
+
+
+class PathCacheTests(unittest.TestCase):
+    def setUp(self):
+        model_manager.clear_model_cache()
+        self.addCleanup(mock.patch.stopall)
+        self.addCleanup(model_manager.clear_model_cache)
+        self.snapshot_download = mock.Mock(side_effect=lambda **kwargs: f"/snap/{kwargs['repo_id']}")
+        mock.patch.dict(sys.modules, _stub_hub(self.snapshot_download)).start()
+
+    def _configure(self, **configs):
+        mock.patch.object(model_manager, "MODEL_CONFIGURATIONS", configs).start()
+
+    def test_models_sharing_a_repo_with_different_patterns_are_cached_separately(self):
+        self._configure(
+            A=model_manager.ModelConfig(repo_id="r", ignore_patterns=("*.bin",)),
+            B=model_manager.ModelConfig(repo_id="r"),
+        )
+        model_manager.download_model("A")
+        model_manager.download_model("B")
+        self.assertEqual(self.snapshot_download.call_count, 2)
+        ignored = [call.kwargs["ignore_patterns"] for call in self.snapshot_download.call_args_list]
+        self.assertIn("*.bin", ignored[0])
+        self.assertNotIn("*.bin", ignored[1])
+
+    def test_repeat_download_is_served_from_the_cache(self):
+        self._configure(A=model_manager.ModelConfig(repo_id="r"))
+        self.assertEqual(model_manager.download_model("A"), "/snap/r")
+        self.assertEqual(model_manager.download_model("A"), "/snap/r")
+        self.assertEqual(self.snapshot_download.call_count, 1)
+
+    def test_clearing_the_cache_forces_a_new_resolve(self):
+        self._configure(A=model_manager.ModelConfig(repo_id="r"))
+        model_manager.download_model("A")
+        model_manager.clear_model_cache()
+        model_manager.download_model("A")
+        self.assertEqual(self.snapshot_download.call_count, 2)
+
+
+
+class DownloadModelsTests(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(mock.patch.stopall)
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+        self.called, self.finished = [], []
+        mock.patch.object(model_manager, "download_model", side_effect=self._download).start()
+
+    def _download(self, name):
+        self.called.append(name)
+        if name == "A":
+            raise model_manager.ModelDownloadError("forbidden")
+        self.release.wait(timeout=5)
+        self.finished.append(name)
+        return f"/snap/{name}"
+
+    def test_first_failure_is_raised_without_waiting_and_queued_work_is_cancelled(self):
+        names = ["A", "B", "C", "D", "E"]
+        with self.assertRaises(model_manager.ModelDownloadError):
+            model_manager.download_models(names, max_workers=2)
+        # Raised while the other worker was still blocked
+        self.assertEqual(self.finished, [])
+        # Each worker is stuck in at most one download, so the rest never start
+        self.assertLessEqual(len(self.called), 3)
+        self.release.set()
+        threading.Event().wait(0.1)
+        self.assertLessEqual(len(self.called), 3)
+
+    def test_results_are_keyed_by_model_name(self):
+        self.release.set()
+        self.assertEqual(
+            model_manager.download_models(["B", "C", "B"]),
+            {"B": "/snap/B", "C": "/snap/C"},
+        )
+
+
+
+class FetchModelFileTests(unittest.TestCase):
+    model_name = "CodeBERT Small"
+
+    def setUp(self):
+        model_manager.clear_model_cache()
+        self.addCleanup(mock.patch.stopall)
+        self.addCleanup(model_manager.clear_model_cache)
+        self.hf_hub_download = mock.Mock(return_value="/cache/snapshots/deadbeef/model.safetensors")
+        mock.patch.dict(sys.modules, _stub_hub(
+            mock.Mock(return_value="/cache/snapshots/deadbeef/"),
+            hf_hub_download=self.hf_hub_download,
+        )).start()
+
+    def test_file_is_pinned_to_the_resolved_snapshot_commit(self):
+        path = model_manager.fetch_model_file(self.model_name, "model.safetensors")
+        self.assertEqual(path, "/cache/snapshots/deadbeef/model.safetensors")
+        self.assertEqual(self.hf_hub_download.call_args.kwargs["revision"], "deadbeef")
+
+    def test_excluded_filename_is_rejected_before_downloading(self):
+        with self.assertRaises(model_manager.ModelDownloadError) as ctx:
+            model_manager.fetch_model_file(self.model_name, "model.onnx")
+        self.assertEqual(ctx.exception.status_code, 400)
+        self.hf_hub_download.assert_not_called()
+
+    def test_unknown_cache_strategy_is_rejected(self):
+        with self.assertRaises(ValueError):
+            model_manager.ModelConfig(repo_id="r", cache_strategy="stream")
+
+
+
+class PerFileDownloadTests(unittest.TestCase):
+    model_name = "CodeBERT Small"
+
+    def setUp(self):
+        model_manager.clear_model_cache()
+        self.addCleanup(mock.patch.stopall)
+        self.addCleanup(model_manager.clear_model_cache)
+        mock.patch.object(model_manager, "DOWNLOAD_MAX_WORKERS", 2).start()
+        self.snapshot_download = mock.Mock(side_effect=lambda **kwargs: f"/snap/{kwargs['revision']}")
+
+    def _stub(self, filenames, hf_hub_download):
+        mock.patch.dict(sys.modules, _stub_hub(
+            self.snapshot_download,
+            HfApi=_stub_api(filenames),
+            hf_hub_download=hf_hub_download,
+        )).start()
+
+    def test_callback_receives_files_in_completion_order(self):
+        first_done = threading.Event()
+
+        def hf_hub_download(repo_id, filename, revision, cache_dir):
+            if filename == "a.bin":
+                # Only finishes once b.bin has been handed to the callback
+                first_done.wait(timeout=5)
+            return f"/snap/{revision}/{filename}"
+
+        ready = []
+
+        def on_file_ready(path):
+            ready.append(path)
+            first_done.set()
+
+        self._stub(["a.bin", "b.bin", "README.md"], hf_hub_download)
+        path = model_manager.download_model(self.model_name, on_file_ready=on_file_ready)
+        self.assertEqual(path, "/snap/abc123")
+        self.assertEqual(ready, ["/snap/abc123/b.bin", "/snap/abc123/a.bin"])
+        self.assertTrue(self.snapshot_download.call_args.kwargs["local_files_only"])
+
+    def test_no_matching_files_is_a_404(self):
+        self._stub(["README.md"], mock.Mock())
+        with self.assertRaises(model_manager.ModelDownloadError) as ctx:
+            model_manager.download_model(self.model_name, on_file_ready=lambda path: None)
+        self.assertEqual(ctx.exception.status_code, 404)
+        self.snapshot_download.assert_not_called()
+
+    def test_failure_cancels_queued_files_and_waits_for_running_ones(self):
+        mock.patch.object(model_manager, "DOWNLOAD_MAX_WORKERS", 1).start()
+        called, finished = [], []
+
+        def hf_hub_download(repo_id, filename, revision, cache_dir):
+            called.append(filename)
+            if filename == "a.bin":
+                raise HfHubHTTPError("forbidden", status_code=403)
+            threading.Event().wait(0.2)
+            finished.append(filename)
+            return filename
+
+        self._stub(["a.bin", "b.bin", "c.bin"], hf_hub_download)
+        with self.assertRaises(model_manager.ModelDownloadError) as ctx:
+            model_manager.download_model(self.model_name, on_file_ready=lambda path: None)
+        self.assertEqual(ctx.exception.status_code, 400)
+        self.assertNotIn("c.bin", called)
+        # Anything that started had finished before the semaphore was released
+        self.assertEqual(called[1:], finished)
+
+    def test_callback_errors_propagate_unwrapped(self):
+        self._stub(["a.bin"], lambda **kwargs: "/snap/abc123/a.bin")
+
+        def on_file_ready(path):
+            raise TypeError("loader bug")
+
+        with self.assertRaises(TypeError):
+            model_manager.download_model(self.model_name, on_file_ready=on_file_ready)
+
+
+
+class VerifySnapshotTests(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.blobs = os.path.join(tmp.name, "blobs")
+        self.snapshot = os.path.join(tmp.name, "snapshots", "abc123")
+        os.makedirs(self.blobs)
+        os.makedirs(self.snapshot)
+
+    def _link(self, name, blob_name, data):
+        blob = os.path.join(self.blobs, blob_name)
+        with open(blob, "wb") as f:
+            f.write(data)
+        path = os.path.join(self.snapshot, name)
+        os.symlink(blob, path)
+        return path
+
+    def test_reports_only_blobs_whose_content_does_not_match_their_name(self):
+        good = b"good weights" * 1000
+        self._link("model-00001.safetensors", hashlib.sha256(good).hexdigest(), good)
+        corrupted = self._link(
+            "model-00002.safetensors", hashlib.sha256(b"original").hexdigest(), b"bit rot"
+        )
+        # Not named after a hash, so there is nothing to compare against
+        self._link("pytorch_model.bin", "not-a-sha256", b"anything")
+
+        self.assertEqual(model_manager.verify_snapshot(self.snapshot), [corrupted])
+
+
+if __name__ == "__main__":
+    unittest.main()